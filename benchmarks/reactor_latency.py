@@ -0,0 +1,84 @@
+'''Measure reactor latency while CallManager events trigger slow side work.
+
+Runs the same command stream through the extra/ server twice: once with
+the side work executed inline on the reactor thread and once through the
+WorkerPool. A probe scheduled every few milliseconds records how late the
+reactor served it; with the pool that lateness should stay flat.
+
+    python benchmarks/reactor_latency.py
+'''
+import json, os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "extra"))
+
+from twisted.internet import reactor, task, defer
+from twisted.internet.testing import StringTransport
+from server import CallCenterFactory, CallManager, Operator, WorkerPool
+
+DURATION = 2.0    # Seconds of traffic for each mode
+PROBE = 0.005     # Interval between reactor latency probes
+COMMAND = 0.030   # Interval between client commands
+SIDE_WORK = 0.050 # Seconds of blocking work per event (CRM stand-in)
+
+class InlinePool(WorkerPool):
+    '''Runs side work synchronously, as if it sat in dataReceived.'''
+    def run(self, key, job):
+        d, func, args = job
+        d.callback(self.done(func(*args), key))
+
+def crm_lookup(call_id, event):
+    '''Local stand-in for a blocking CRM request.'''
+    time.sleep(SIDE_WORK)
+
+def commands():
+    '''Endless call -> answer -> hangup cycle as JSON frames.'''
+    call = 0
+    while True:
+        call += 1
+        for command, args in (("call", str(call)), ("answer", "A"),
+                              ("hangup", str(call))):
+            yield json.dumps({"command":command, "args":args}).encode('utf-8')
+
+@defer.inlineCallbacks
+def measure(name, workers):
+    factory = CallCenterFactory()
+    factory.manager = CallManager([Operator("A"), Operator("B")]) # Same start per mode
+    factory.manager.protocol = factory
+    factory.workers = workers
+    workers.add_hook(crm_lookup)
+    factory.doStart()
+    proto = factory.buildProtocol(None)
+    proto.makeConnection(StringTransport())
+
+    lateness, frames = [], commands()
+    last = [reactor.seconds()]
+    def probe():
+        now = reactor.seconds()
+        lateness.append(max(0.0, now - last[0] - PROBE))
+        last[0] = now
+
+    probes = task.LoopingCall(probe)
+    sender = task.LoopingCall(lambda: proto.frameReceived(next(frames)))
+    probes.start(PROBE)
+    sender.start(COMMAND)
+    yield task.deferLater(reactor, DURATION, lambda: None)
+    sender.stop()
+    probes.stop()
+    factory.doStop()
+
+    lateness.sort()
+    p99 = lateness[int(len(lateness) * 0.99) - 1]
+    print(f"{name:<8}{1000*sum(lateness)/len(lateness):>10.2f}"
+          f"{1000*p99:>10.2f}{1000*lateness[-1]:>10.2f}")
+
+@defer.inlineCallbacks
+def main():
+    print(f"{'mode':<8}{'mean ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    try:
+        yield measure("inline", InlinePool())
+        yield measure("pool", WorkerPool())
+    finally:
+        reactor.stop()
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
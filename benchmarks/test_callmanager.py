@@ -0,0 +1,106 @@
+'''Microbenchmarks for each CallManager operation on every implementation.
+
+State is built directly on Operator/Queue before each round so only the
+measured command is timed. Run with pytest-benchmark installed:
+
+    python -m pytest benchmarks/test_callmanager.py
+'''
+import os, sys
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "tests"))
+
+pytest.importorskip("pytest_benchmark")
+from harness import IMPLEMENTATIONS, operator_ids
+
+ROSTERS = [2, 64, 1024] # Operators in the call center
+QUEUES = [0, 64, 1024]  # Calls waiting in queue
+ROUNDS = 50
+
+def busy_center(load, roster, queue):
+    '''Roster with every operator busy and <queue> calls waiting.'''
+    runner = load(operator_ids(roster))
+    manager = runner.manager
+    for call, op in enumerate(manager.operators.operators.values(), 1):
+        runner.ring(op, call)
+        op.answer()
+    for call in range(roster + 1, roster + queue + 1):
+        manager.queue.hold(call)
+    return runner
+
+def last_operator(runner):
+    return list(runner.manager.operators.operators.values())[-1]
+
+def ringing_last(load, roster, queue):
+    '''Busy center whose last operator is ringing instead.'''
+    runner = busy_center(load, roster, queue)
+    op = last_operator(runner)
+    call = op.call
+    op.hangup()
+    runner.ring(op, call)
+    return runner
+
+def bench(benchmark, setup, command, args):
+    '''Time runner.run(command, args(runner)) on fresh state each round.'''
+    def prepare():
+        runner = setup()
+        return (runner, command, args(runner)), {}
+    benchmark.pedantic(lambda runner, command, arg: runner.run(command, arg),
+                       setup=prepare, rounds=ROUNDS)
+
+cases = pytest.mark.parametrize("queue", QUEUES, ids="queue{}".format)
+sizes = pytest.mark.parametrize("roster", ROSTERS, ids="roster{}".format)
+impls = pytest.mark.parametrize("impl", IMPLEMENTATIONS)
+
+@impls
+@sizes
+@cases
+def test_call(benchmark, impl, roster, queue):
+    '''New call scanning a fully busy roster and waiting in queue.'''
+    load = IMPLEMENTATIONS[impl]
+    bench(benchmark, lambda: busy_center(load, roster, queue),
+          "call", lambda runner: str(roster + queue + 1))
+
+@impls
+@sizes
+@cases
+def test_answer(benchmark, impl, roster, queue):
+    '''Answer by the last operator, ringing while the rest are busy.'''
+    load = IMPLEMENTATIONS[impl]
+    bench(benchmark, lambda: ringing_last(load, roster, queue),
+          "answer", lambda runner: last_operator(runner).id)
+
+@impls
+@sizes
+@cases
+def test_reject(benchmark, impl, roster, queue):
+    '''Reject requeues the call and rings the roster again.'''
+    load = IMPLEMENTATIONS[impl]
+    bench(benchmark, lambda: ringing_last(load, roster, queue),
+          "reject", lambda runner: last_operator(runner).id)
+
+@impls
+@sizes
+@cases
+def test_hangup_active(benchmark, impl, roster, queue):
+    '''Hangup of the last operator's call, which then takes the next one.'''
+    load = IMPLEMENTATIONS[impl]
+    bench(benchmark, lambda: busy_center(load, roster, queue),
+          "hangup", lambda runner: str(last_operator(runner).call))
+
+@impls
+@sizes
+@pytest.mark.parametrize("queue", [q for q in QUEUES if q], ids="queue{}".format)
+def test_hangup_queued(benchmark, impl, roster, queue):
+    '''Hangup of the call held longest, at the far end of the queue scan.'''
+    load = IMPLEMENTATIONS[impl]
+    bench(benchmark, lambda: busy_center(load, roster, queue),
+          "hangup", lambda runner: str(roster + 1))
+
+@impls
+@sizes
+@cases
+def test_hangup_unknown(benchmark, impl, roster, queue):
+    '''Hangup of a call that is neither queued nor assigned.'''
+    load = IMPLEMENTATIONS[impl]
+    bench(benchmark, lambda: busy_center(load, roster, queue),
+          "hangup", lambda runner: "0")
@@ -16,11 +16,13 @@ class Client(basic.LineReceiver):
         
     def sendCommand(self, message):
         "Send command to call center server."
-        self.transport.write(message)
+        self.sendLine(message)
 
-    def dataReceived(self, data):
+    def lineReceived(self, line):
         "Exhibit server's reply."
-        print(json.loads(data)['response'], "\n>> ", end="")
+        data = json.loads(line)
+        if data.get('session', 0) : print(f"[{data['session']}]", end=" ")
+        print(data['response'], "\n>> ", end="")
     
     def disconnect(self):
         self.transport.loseConnection()
@@ -46,13 +48,15 @@ class CmdInterface(Cmd):
     def __init__(self, agent):
         Cmd.__init__(self)
         self.agent = agent
+        self.session = 0 # Logical session used for the following commands
 
     # Auxiliary Functions
 
     def jsonfy(self, args):
         '''Convert command and argumets to a JSON bytearray.'''
         command = inspect.stack()[1].function.split('_')[-1]
-        json_str = json.dumps({"command":command, "args":args})
+        json_str = json.dumps(
+            {"session":self.session, "command":command, "args":args})
         return json_str.encode('utf-8')
 
     def eventLaucher(self, msg):
@@ -71,6 +75,26 @@ class CmdInterface(Cmd):
     def do_hangup(self, args):
         self.eventLaucher(self.jsonfy(args))
 
+    # Session Commands
+
+    def do_session(self, args):
+        '''Switch the logical session used for the following commands.'''
+        try: self.session = int(args) if args else 0
+        except ValueError:
+            print("Usage: session [<number>]", "\n>> ", end="")
+            return
+        print(f"Using session {self.session}", "\n>> ", end="")
+    def do_open(self, args):
+        self.eventLaucher(self.jsonfy(args))
+    def do_close(self, args):
+        self.eventLaucher(self.jsonfy(args))
+    def do_bind(self, args):
+        self.eventLaucher(self.jsonfy(args))
+    def do_subscribe(self, args):
+        self.eventLaucher(self.jsonfy(args))
+    def do_credit(self, args):
+        self.eventLaucher(self.jsonfy(args))
+
     # Terminator Functions
 
     def do_exit(self, args):
@@ -1,7 +1,16 @@
 from enum import Enum
 import json
 from collections import deque
-from twisted.internet import reactor, protocol
+from twisted.internet import reactor, protocol, threads, defer
+from twisted.python import log
+from twisted.python.threadpool import ThreadPool
+
+DEFAULT_SESSION = 0 # Session used by frames that carry no session ID
+DEFAULT_WINDOW = 16 # Initial flow control credits of an opened session
+MAX_HELD = 256      # Messages a session holds back before dropping new ones
+MAX_FRAME = 16384   # Bytes an incomplete frame may take before being dropped
+WORKER_THREADS = 4  # Threads running side work off the reactor
+MAX_PENDING = 1024  # Side work jobs allowed to wait before dropping new ones
 
 class Operator():
     '''Implements individual Operator actions and states.'''
@@ -86,7 +95,7 @@ class CallManager():
     '''Coordinate call-operator assignments and responses to client side.'''
     def __init__(self, operators):
         self.operators = Operators(operators) # Working Operators
-        self.protocol = None # Reference to client communication protocol
+        self.protocol = None # Reference to the timeout event dispatcher
         self.queue = Queue() # Calls pool
 
     def set_timeout(self, call_id, op):
@@ -159,34 +168,346 @@ class CallManager():
         
         return msg
 
+class WorkerPool():
+    '''Runs blocking side work (audit, CRM lookups...) off the reactor.'''
+
+    def __init__(self, size=WORKER_THREADS, max_pending=MAX_PENDING):
+        self.threadpool = ThreadPool(1, size, name="side-work")
+        self.max_pending = max_pending
+        self.pending = 0  # Jobs submitted and not finished yet
+        self.queues = {}  # Jobs waiting behind the running one for each key
+        self.hooks = []   # Functions called as hook(call_id, event)
+        self.stopped = True
+        self.trigger = None # Reactor shutdown trigger joining the threads
+
+    def start(self):
+        self.stopped = False
+        if not self.threadpool.started : self.threadpool.start()
+        if not self.trigger:
+            self.trigger = reactor.addSystemEventTrigger(
+                "during", "shutdown", self.shutdown, fired=True)
+
+    def stop(self):
+        '''Refuse new jobs and cancel the waiting ones.
+
+        Running jobs finish in their threads; the threads themselves are
+        joined at reactor shutdown so the reactor never blocks on them.
+        '''
+        self.stopped = True
+        for queue in self.queues.values():
+            while queue:
+                self.pending -= 1
+                queue.popleft()[0].errback(defer.CancelledError())
+
+    def shutdown(self, fired=False):
+        '''Stop and join the threads; <fired> if run by the shutdown trigger.'''
+        self.stop()
+        if self.trigger and not fired: # A fired trigger is already gone
+            reactor.removeSystemEventTrigger(self.trigger)
+        self.trigger = None
+        if self.threadpool.started : self.threadpool.stop()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def dispatch(self, msg):
+        '''Hand every event of a CallManager reply to the hooks.'''
+        for event in msg.splitlines():
+            call_id = event.split()[1] # Events read "Call <id> ..."
+            for hook in self.hooks:
+                d = self.submit(call_id, hook, call_id, event)
+                if d : d.addErrback(self.failed, event)
+                else : log.msg(f"Side work not accepted, dropped: {event}")
+
+    def failed(self, failure, event):
+        '''Log hook errors; jobs cancelled by stop() are expected.'''
+        if not failure.check(defer.CancelledError):
+            log.err(failure, f"Side work failed: {event}")
+
+    def submit(self, key, func, *args):
+        '''Run func(*args) in a thread after earlier jobs of the same <key>.
+
+        Returns a Deferred firing with the result, or None if the pool is
+        stopped or already holds <max_pending> jobs.
+        '''
+        if self.stopped or self.pending >= self.max_pending : return None
+        self.pending += 1
+        job = (defer.Deferred(), func, args)
+        if key in self.queues:
+            self.queues[key].append(job)
+        else:
+            self.queues[key] = deque()
+            self.run(key, job)
+        return job[0]
+
+    def run(self, key, job):
+        d, func, args = job
+        work = threads.deferToThreadPool(reactor, self.threadpool, func, *args)
+        work.addBoth(self.done, key)
+        work.chainDeferred(d)
+
+    def done(self, result, key):
+        '''Release the finished job and start the next one for <key>.'''
+        self.pending -= 1
+        if self.queues[key] : self.run(key, self.queues[key].popleft())
+        else                : del self.queues[key]
+        return result
+
+class FrameError(Exception):
+    '''Invalid client frame, reported back to the session that sent it.'''
+
+def number(args, error):
+    '''Convert <args> to a non-negative int, raising FrameError(<error>).'''
+    try    : value = int(args)
+    except (TypeError, ValueError) : raise FrameError(f"{error} {args}")
+    if value < 0 : raise FrameError(f"{error} {args}")
+    return value
+
+def event_operator(event, calls):
+    '''Return the Operator ID an event is about, if any.
+
+    Events that do not name the operator (e.g. a ringing call missed) are
+    matched through <calls>, the call ID to Operator ID assignments.
+    '''
+    words = event.split()
+    if "operator" in words[:-1] : return words[words.index("operator") + 1]
+    return calls.get(words[1]) if len(words) > 1 else None
+
+class Session():
+    '''Logical client session multiplexed over a single connection.'''
+    Events = Enum("event", "NONE OPERATOR ALL")
+
+    def __init__(self, id, writer, window=None):
+        self.id = id
+        self.writer = writer    # Function that puts a message on the wire
+        self.operator = None    # ID of the operator bound to this session
+        self.events = Session.Events.OPERATOR
+        self.window = window    # Messages allowed before more credit (None = unbounded)
+        self.pending = deque()  # Messages held back by flow control
+        self.dropped = 0        # Messages discarded since pending got full
+
+    # Event Subscription Functions
+
+    def bind(self, op_id):
+        self.operator = op_id
+    def subscribe(self, events):
+        self.events = Session.Events[events.upper()]
+
+    # Flow Control Functions
+
+    def send(self, msg):
+        '''Write <msg> if the window allows it, otherwise hold it.'''
+        if len(self.pending) < MAX_HELD : self.pending.append(msg)
+        else                            : self.dropped += 1
+        self.flush()
+
+    def credit(self, amount):
+        '''Grant <amount> more messages to the session and release held ones.'''
+        if self.window is not None : self.window += amount
+        self.flush()
+
+    def flush(self):
+        while (self.pending or self.dropped) and (self.window is None or self.window > 0):
+            if self.window is not None : self.window -= 1
+            if self.pending:
+                self.writer(self.pending.popleft())
+            else: # Tell the client about the gap once held messages are out
+                self.writer(f"Session {self.id} dropped {self.dropped} messages")
+                self.dropped = 0
+
 class CallCenterProtocol(protocol.Protocol):
-    '''Implements interface between the CallManager and the Client.'''
+    '''Implements interface between the CallManager and the Client sessions.'''
+    delimiter = b"\r\n"
+    commands = ("call", "answer", "reject", "hangup") # CallManager commands
 
     def __init__(self, factory):
         self.factory = factory
-        factory.manager.protocol = self # Allows manager to access protocol functions
+        self.buffer = b"" # Bytes of a frame not fully received yet
+        # Frames without a session ID fall in the default session, which
+        # only gets replies, as older single-session clients expect
+        self.sessions = {}
+        self.session_open(DEFAULT_SESSION, None, reply=False)
 
-    def jsonfy(self, args):
+    def jsonfy(self, session_id, args):
         '''Convert reply to a JSON bytearray.'''
-        json_str = json.dumps({"response":args})
+        json_str = json.dumps({"session":session_id, "response":args})
         return json_str.encode('utf-8')
 
-    def checkTimeout(self, call_id):
-        '''Function for setting up countdown-based callbacks'''
-        msg = self.factory.manager.do_timeout(call_id)
-        if msg : self.transport.write(self.jsonfy(msg))
+    def reply(self, session_id, msg):
+        '''Write <msg> to session <session_id>, bypassing flow control.'''
+        self.transport.write(self.jsonfy(session_id, msg) + self.delimiter)
+
+    def connectionLost(self, reason):
+        for session in self.sessions.values() : self.factory.untrack(session)
 
     def dataReceived(self, data):
-        '''Process command received from client.'''
-        data = json.loads(data)
-        method = getattr(self.factory.manager, "do_"+data['command']) # retrive method addr
-        msg = method(data['args'])
-        self.transport.write(self.jsonfy(msg))
+        '''Split received bytes in frames and process each one.'''
+        *frames, self.buffer = (self.buffer + data).split(self.delimiter)
+        if self.buffer.rstrip().endswith(b"}") : frames += self.bareFrames()
+        if len(self.buffer) > MAX_FRAME: # Never completed, stop buffering it
+            self.buffer = b""
+            self.reply(DEFAULT_SESSION, "Frame too long")
+        for frame in frames:
+            if frame.strip() : self.frameReceived(frame)
+
+    def bareFrames(self):
+        '''Pop JSON objects older clients sent without delimiter.'''
+        frames, decoder = [], json.JSONDecoder()
+        try    : text = self.buffer.decode('utf-8').lstrip()
+        except UnicodeDecodeError : return frames
+        while text:
+            try    : _, end = decoder.raw_decode(text)
+            except ValueError : break
+            frames.append(text[:end].encode('utf-8'))
+            text = text[end:].lstrip()
+        self.buffer = text.encode('utf-8')
+        return frames
+
+    def frameReceived(self, frame):
+        '''Process command received from client on behalf of a session.
+
+        Errors are answered to the offending session only, so one bad
+        frame does not tear down the other sessions on this connection.
+        '''
+        session_id = DEFAULT_SESSION
+        try:
+            session_id, command, args = self.parse(frame)
+            if session_id not in self.sessions and command != "open":
+                raise FrameError(f"Session {session_id} not open")
+            control = getattr(self, "session_"+command, None) # session level command
+            if control                 : control(session_id, args)
+            elif command in self.commands : self.execute(self.sessions[session_id], command, args)
+            else                       : raise FrameError(f"Unknown command {command}")
+        except FrameError as exc:
+            self.reply(session_id, str(exc))
+        except Exception:
+            log.err(None, f"Failed to process frame {frame!r}")
+            self.reply(session_id, "Internal error")
+
+    def parse(self, frame):
+        '''Return session ID, command and arguments of a JSON frame.'''
+        try    : data = json.loads(frame)
+        except ValueError : raise FrameError("Malformed frame")
+        if not isinstance(data, dict) : raise FrameError("Malformed frame")
+        session_id, command = data.get('session', DEFAULT_SESSION), data.get('command')
+        args = data.get('args') or None # Empty args mean no args
+        if not isinstance(session_id, int) or isinstance(session_id, bool):
+            raise FrameError("Malformed frame")
+        if not isinstance(command, str) or not isinstance(args, (str, type(None))):
+            raise FrameError("Malformed frame")
+        return session_id, command, args
+
+    def execute(self, session, command, args):
+        '''Run CallManager command, reply to the session and fan it out.'''
+        manager = self.factory.manager
+        if command in ("answer", "reject"):
+            args = args or session.operator
+            operator = manager.operators.get(args)
+            if not operator : raise FrameError(f"Operator {args} not found")
+            if command == "reject" and not operator.is_ringing():
+                raise FrameError(f"Operator {args} has no ringing call")
+        else:
+            args = str(number(args, "Invalid call ID"))
+        calls = {} # Operator of a hung up call, for events not naming it
+        if command == "hangup":
+            operator = manager.operators.search_call(int(args))
+            if operator : calls[args] = operator.id
+        method = getattr(manager, "do_"+command) # retrive method addr
+        msg = method(args)
+        session.send(msg)
+        self.factory.publish(msg, calls, origin=session)
+        self.factory.workers.dispatch(msg)
+
+    # Session Control Commands
+
+    def session_open(self, session_id, window, reply=True):
+        if session_id in self.sessions:
+            raise FrameError(f"Session {session_id} already open")
+        if session_id == DEFAULT_SESSION: # Unbounded and replies only
+            session = Session(session_id, lambda msg: self.reply(session_id, msg))
+            session.subscribe("none")
+        else:
+            window = DEFAULT_WINDOW if window is None else number(window, "Invalid window")
+            session = Session(session_id, lambda msg: self.reply(session_id, msg), window)
+        self.sessions[session_id] = session
+        self.factory.track(session)
+        if reply : self.reply(session_id, f"Session {session_id} opened")
+
+    def session_close(self, session_id, args):
+        self.factory.untrack(self.sessions.pop(session_id)) # Held messages are dropped
+        if session_id == DEFAULT_SESSION: # Default session is always available
+            self.session_open(session_id, None, reply=False)
+        self.reply(session_id, f"Session {session_id} closed")
+
+    def session_bind(self, session_id, op_id):
+        if not self.factory.manager.operators.get(op_id):
+            raise FrameError(f"Operator {op_id} not found")
+        session = self.sessions[session_id]
+        self.factory.untrack(session)
+        session.bind(op_id)
+        self.factory.track(session)
+        session.send(f"Session {session_id} bound to operator {op_id}")
+
+    def session_subscribe(self, session_id, events):
+        if not events or events.upper() not in Session.Events.__members__:
+            raise FrameError(f"Unknown event subscription {events}")
+        session = self.sessions[session_id]
+        self.factory.untrack(session)
+        session.subscribe(events)
+        self.factory.track(session)
+        session.send(f"Session {session_id} subscribed to {events.lower()} events")
+
+    def session_credit(self, session_id, amount):
+        amount = number(amount, "Invalid credit")
+        # No reply: it would spend the very credit being granted
+        self.sessions[session_id].credit(amount)
 
 class CallCenterFactory(protocol.ServerFactory):
     "Factory to mantain persistent data across connections"
     manager = CallManager([Operator("A"), Operator("B")])
 
+    def __init__(self):
+        self.bound = {}     # Operator ID -> sessions following that operator
+        self.listeners = {} # Sessions subscribed to all events (ordered set)
+        self.manager.protocol = self # Allows manager to dispatch timeouts
+        self.workers = WorkerPool() # Side work kept out of the reactor thread
+
+    def startFactory(self) : self.workers.start()
+    def stopFactory(self)  : self.workers.stop()
+
+    # Event Fan-out Functions
+
+    def track(self, session):
+        '''Index <session> by its current subscription.'''
+        if session.events == Session.Events.ALL:
+            self.listeners[session] = None
+        elif session.events == Session.Events.OPERATOR and session.operator:
+            self.bound.setdefault(session.operator, {})[session] = None
+
+    def untrack(self, session):
+        '''Drop <session> from the index; call before changing its subscription.'''
+        self.listeners.pop(session, None)
+        sessions = self.bound.get(session.operator)
+        if sessions is not None:
+            sessions.pop(session, None)
+            if not sessions : del self.bound[session.operator]
+
+    def publish(self, msg, calls=None, origin=None):
+        '''Fan the events of <msg> out to the sessions subscribed to them.'''
+        targets = {} # Session -> its events, in order
+        for event in filter(None, msg.splitlines()):
+            op_id = event_operator(event, calls or {})
+            for session in (*self.listeners, *self.bound.get(op_id, ())):
+                if session is not origin : targets.setdefault(session, []).append(event)
+        for session, events in targets.items() : session.send("\n".join(events))
+
+    def checkTimeout(self, call_id):
+        '''Function for setting up countdown-based callbacks'''
+        msg = self.manager.do_timeout(call_id)
+        if msg:
+            self.publish(msg)
+            self.workers.dispatch(msg)
+
     def buildProtocol(self, data):
         return CallCenterProtocol(self)
 
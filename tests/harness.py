@@ -0,0 +1,132 @@
+'''Shared helpers to drive every CallManager implementation side by side.
+
+Each implementation is exposed as a runner: run(command, args) executes
+CallManager.do_<command> and returns the emitted events as a list of
+lines, whatever the implementation does with them (print or return).
+New or optimized data structures join the differential tests and the
+benchmarks by adding a loader to IMPLEMENTATIONS.
+'''
+import io, os, random
+import importlib.util
+from functools import lru_cache
+from contextlib import contextmanager, redirect_stdout
+from types import SimpleNamespace
+from twisted.internet import task
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+@lru_cache(maxsize=None)
+def load(name, path):
+    '''Import <path> under a unique module name (servers share "server").'''
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+class Runner():
+    '''Drives one CallManager and collects its events.'''
+
+    def __init__(self, module, op_ids):
+        self.module = module
+        self.manager = module.CallManager([module.Operator(i) for i in op_ids])
+
+    def run(self, command, args):
+        msg = self.emit(getattr(self.manager, "do_"+command), args)
+        return [event for event in msg.splitlines() if event] # Drop blank lines
+
+    def emit(self, method, args):
+        return method(args)
+
+    def ring(self, op, call):
+        '''Put <call> ringing on <op> without going through do_call.'''
+        op.ring(call)
+
+class PrintRunner(Runner):
+    '''basic/ prints its events instead of returning them.'''
+    def emit(self, method, args):
+        out = io.StringIO()
+        with redirect_stdout(out) : method(args)
+        return out.getvalue()
+
+class TimeoutRunner(Runner):
+    '''extra/ schedules ring timeouts; a private Clock keeps them idle.'''
+
+    def __init__(self, module, op_ids):
+        Runner.__init__(self, module, op_ids)
+        self.clock = task.Clock() # Timeouts never fire unless advanced
+        self.manager.protocol = SimpleNamespace(checkTimeout=lambda call: None)
+
+    @contextmanager
+    def idle_reactor(self):
+        '''Swap the module reactor for the Clock only while the runner works.'''
+        reactor, self.module.reactor = self.module.reactor, self.clock
+        try     : yield
+        finally : self.module.reactor = reactor
+
+    def emit(self, method, args):
+        with self.idle_reactor() : return method(args)
+
+    def ring(self, op, call):
+        op.ring(call)
+        with self.idle_reactor() : self.manager.set_timeout(call, op)
+
+def basic(op_ids)    : return PrintRunner(load("basic_callcenter", "basic/callcenter.py"), op_ids)
+def advanced(op_ids) : return Runner(load("advanced_server", "advanced/server.py"), op_ids)
+def extra(op_ids)    : return TimeoutRunner(load("extra_server", "extra/server.py"), op_ids)
+
+# The first implementation is the reference the command generator follows
+IMPLEMENTATIONS = {"basic": basic, "advanced": advanced, "extra": extra}
+
+def operator_ids(count):
+    return [f"OP{i}" for i in range(count)] if count > 2 else ["A", "B"][:count]
+
+class CommandGenerator():
+    '''Random command stream that stays within defined CallManager inputs.
+
+    Commands are picked from the reference manager state, so answer and
+    reject only target ringing operators, while still covering the edge
+    cases: answering idle operators, rejecting and then hanging up the
+    same call, and hanging up calls that are unknown or already ended.
+    '''
+
+    def __init__(self, seed, manager):
+        self.rng = random.Random(seed)
+        self.manager = manager
+        self.next_call = 1
+        self.followup = None # Command forced right after the previous one
+
+    def operators(self, check):
+        return [op for op in self.manager.operators.operators.values() if check(op)]
+
+    def calls(self):
+        '''Calls currently queued or assigned to an operator.'''
+        assigned = [op.call for op in self.operators(lambda op: op.call is not None)]
+        return assigned + list(self.manager.queue.queue)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.followup:
+            command, self.followup = self.followup, None
+            return command
+        rng = self.rng
+        ringing = self.operators(lambda op: op.is_ringing())
+        idle = self.operators(lambda op: not op.is_ringing())
+        calls = self.calls()
+        roll = rng.random()
+        if roll < 0.35 or not (ringing or calls):
+            self.next_call += 1
+            return ("call", str(self.next_call - 1))
+        if roll < 0.55 and ringing:
+            return ("answer", rng.choice(ringing).id)
+        if roll < 0.60 and idle:
+            return ("answer", rng.choice(idle).id)
+        if roll < 0.72 and ringing:
+            op = rng.choice(ringing)
+            if rng.random() < 0.5 : self.followup = ("hangup", str(op.call))
+            return ("reject", op.id)
+        if roll < 0.90 and calls:
+            return ("hangup", str(rng.choice(calls)))
+        # Never issued, or possibly already finished
+        return ("hangup", str(rng.randrange(1, self.next_call + 5)))
@@ -0,0 +1,35 @@
+'''Differential tests: every implementation must emit the same events.'''
+import os, random
+import pytest
+from harness import IMPLEMENTATIONS, CommandGenerator, operator_ids
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STEPS = 2000 # Commands per random sequence
+
+def runners(op_ids):
+    return {name: load(op_ids) for name, load in IMPLEMENTATIONS.items()}
+
+def test_fixed_script():
+    '''Replay tests/input.txt and compare with tests/expected.txt.'''
+    with open(os.path.join(HERE, "input.txt")) as f:
+        commands = [line.split() for line in f if line.strip() != "exit"]
+    with open(os.path.join(HERE, "expected.txt")) as f:
+        expected = f.read().splitlines()[1:] # Skip connection banner
+
+    for name, runner in runners(["A", "B"]).items():
+        events = []
+        for command, args in commands : events += runner.run(command, args)
+        assert events == expected, name
+
+@pytest.mark.parametrize("seed", range(20))
+def test_random_sequences(seed):
+    '''Run a long random command stream through all implementations.'''
+    impls = runners(operator_ids(random.Random(seed).randint(1, 6)))
+    reference = next(iter(impls.values()))
+    history = []
+    for step, (command, args) in zip(range(STEPS), CommandGenerator(seed, reference.manager)):
+        history.append(f"{command} {args}")
+        events = {name: runner.run(command, args) for name, runner in impls.items()}
+        assert len(set(map(tuple, events.values()))) == 1, (
+            f"seed {seed} diverged at step {step}\n"
+            + "\n".join(history[-10:]) + f"\n{events}")
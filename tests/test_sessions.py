@@ -0,0 +1,181 @@
+'''Protocol tests for sessions multiplexed by the extra/ server.'''
+import json
+import pytest
+from twisted.internet import task
+from twisted.internet.testing import StringTransport
+from harness import load
+
+@pytest.fixture
+def server(monkeypatch):
+    server = load("extra_server", "extra/server.py")
+    monkeypatch.setattr(server, "reactor", task.Clock()) # Timeouts fire on advance()
+    return server
+
+@pytest.fixture
+def factory(server):
+    factory = server.CallCenterFactory()
+    factory.manager = server.CallManager([server.Operator("A"), server.Operator("B")])
+    factory.manager.protocol = factory
+    return factory
+
+def connect(factory):
+    proto = factory.buildProtocol(None)
+    proto.makeConnection(StringTransport())
+    return proto
+
+def send(proto, **frame):
+    proto.dataReceived(json.dumps(frame).encode('utf-8') + b"\r\n")
+
+def replies(proto):
+    '''Return and clear the (session, response) pairs written so far.'''
+    frames = proto.transport.value().split(b"\r\n")
+    proto.transport.clear()
+    return [(f["session"], f["response"]) for f in map(json.loads, filter(None, frames))]
+
+def test_bare_frame_from_older_client(factory):
+    proto = connect(factory)
+    proto.dataReceived(b'{"command":"call","args":"1"}')
+    assert replies(proto) == [(0, "Call 1 received\nCall 1 ringing for operator A")]
+
+def test_bare_frames_back_to_back(factory):
+    proto = connect(factory)
+    proto.dataReceived(b'{"command":"call","args":"1"}{"command":"call","args":"2"}')
+    assert replies(proto) == [(0, "Call 1 received\nCall 1 ringing for operator A"),
+                              (0, "Call 2 received\nCall 2 ringing for operator B")]
+
+def test_older_clients_only_get_their_replies(factory, server):
+    first, second = connect(factory), connect(factory)
+    send(first, command="call", args="1")
+    send(first, command="call", args="2")
+    server.reactor.advance(10)
+    assert len(replies(first)) == 2
+    assert replies(second) == []
+
+def test_frame_too_long(factory, server, monkeypatch):
+    monkeypatch.setattr(server, "MAX_FRAME", 64)
+    proto = connect(factory)
+    proto.dataReceived(b'{"command":"call", "args":"' + b"1" * 64)
+    assert replies(proto) == [(0, "Frame too long")]
+    send(proto, command="call", args="1")
+    assert replies(proto) == [(0, "Call 1 received\nCall 1 ringing for operator A")]
+
+def test_frame_split_across_reads(factory):
+    proto = connect(factory)
+    frame = json.dumps({"command":"call", "args":"1"}).encode('utf-8') + b"\r\n"
+    proto.dataReceived(frame[:10])
+    assert replies(proto) == []
+    proto.dataReceived(frame[10:])
+    assert replies(proto) == [(0, "Call 1 received\nCall 1 ringing for operator A")]
+
+def test_routing_by_binding(factory):
+    console, gateway = connect(factory), connect(factory)
+    for session, op_id in ((1, "A"), (2, "B")):
+        send(console, session=session, command="open", args="")
+        send(console, session=session, command="bind", args=op_id)
+    send(gateway, session=3, command="open", args="")
+    send(gateway, session=4, command="open", args="")
+    send(gateway, session=4, command="subscribe", args="all")
+    replies(console), replies(gateway)
+
+    send(gateway, session=3, command="call", args="9")
+    assert replies(console) == [(1, "Call 9 ringing for operator A")]
+    # Requester gets its reply once, fan-out is opt-in through subscribe
+    assert replies(gateway) == [(3, "Call 9 received\nCall 9 ringing for operator A"),
+                                (4, "Call 9 received\nCall 9 ringing for operator A")]
+
+    send(console, session=1, command="answer", args="")
+    assert replies(console) == [(1, "Call 9 answered by operator A")]
+
+def test_index_follows_rebind_close_and_disconnect(factory):
+    console = connect(factory)
+    send(console, session=1, command="open", args="")
+    send(console, session=1, command="bind", args="A")
+    send(console, session=1, command="bind", args="B")
+    send(console, session=2, command="open", args="")
+    send(console, session=2, command="subscribe", args="all")
+    assert (list(factory.bound), len(factory.listeners)) == (["B"], 1)
+    send(console, session=1, command="close", args="")
+    assert factory.bound == {}
+    console.connectionLost(None)
+    assert factory.listeners == {}
+
+def test_timeout_reaches_bound_session(factory, server):
+    console, gateway = connect(factory), connect(factory)
+    send(console, session=1, command="open", args="")
+    send(console, session=1, command="bind", args="A")
+    send(gateway, command="call", args="5")
+    replies(console)
+    server.reactor.advance(10)
+    assert (1, "Call 5 ignored by operator A") in replies(console)
+
+def test_flow_control_holds_until_credit(factory):
+    console, gateway = connect(factory), connect(factory)
+    send(console, session=1, command="open", args="2")
+    send(console, session=1, command="bind", args="A")
+    send(gateway, command="call", args="1")
+    send(gateway, command="hangup", args="1")
+    send(gateway, command="call", args="2")
+    # Window of 2 spent on the bind reply and the first ring
+    assert replies(console) == [(1, "Session 1 opened"),
+                                (1, "Session 1 bound to operator A"),
+                                (1, "Call 1 ringing for operator A")]
+    send(console, session=1, command="credit", args="5")
+    assert replies(console) == [(1, "Call 1 missed"),
+                                (1, "Call 2 ringing for operator A")]
+
+def test_held_messages_are_capped(factory, server, monkeypatch):
+    monkeypatch.setattr(server, "MAX_HELD", 2)
+    console, gateway = connect(factory), connect(factory)
+    send(console, session=1, command="open", args="0")
+    send(console, session=1, command="subscribe", args="all")
+    for call in range(1, 5) : send(gateway, command="call", args=str(call))
+    replies(console)
+    send(console, session=1, command="credit", args="10")
+    assert [msg for _, msg in replies(console)] == [
+        "Session 1 subscribed to all events",
+        "Call 1 received\nCall 1 ringing for operator A",
+        "Session 1 dropped 3 messages"]
+
+def test_close_default_session(factory):
+    proto = connect(factory)
+    send(proto, session=0, command="subscribe", args="all")
+    send(proto, session=0, command="close", args="")
+    send(connect(factory), command="call", args="1")
+    send(proto, command="call", args="2")
+    # Reopened session 0 is back to replies only
+    assert replies(proto) == [(0, "Session 0 subscribed to all events"),
+                              (0, "Session 0 closed"),
+                              (0, "Call 2 received\nCall 2 ringing for operator B")]
+
+def test_session_not_open(factory):
+    proto = connect(factory)
+    send(proto, session=4, command="call", args="1")
+    send(proto, session=4, command="open", args="")
+    send(proto, session=4, command="close", args="")
+    send(proto, session=4, command="bind", args="A")
+    assert replies(proto) == [(4, "Session 4 not open"), (4, "Session 4 opened"),
+                              (4, "Session 4 closed"), (4, "Session 4 not open")]
+
+@pytest.mark.parametrize("frame, error", [
+    (b"not json", "Malformed frame"),
+    (b'["call", "1"]', "Malformed frame"),
+    (b'{"session":1, "command":"answer", "args":""}', "Operator None not found"),
+    (b'{"session":1, "command":"reject", "args":"B"}', "Operator B has no ringing call"),
+    (b'{"session":1, "command":"call", "args":"x"}', "Invalid call ID x"),
+    ('{"session":1, "command":"hangup", "args":"\u00b2"}'.encode('utf-8'), "Invalid call ID \u00b2"),
+    ('{"session":1, "command":"credit", "args":"\u00b2"}'.encode('utf-8'), "Invalid credit \u00b2"),
+    (b'{"session":1, "command":"credit", "args":"x"}', "Invalid credit x"),
+    (b'{"session":1, "command":"credit", "args":"-1"}', "Invalid credit -1"),
+    (b'{"session":1, "command":"subscribe", "args":"some"}', "Unknown event subscription some"),
+    (b'{"session":1, "command":"timeout", "args":"1"}', "Unknown command timeout"),
+    (b'{"session":2, "command":"open", "args":"abc"}', "Invalid window abc"),
+])
+def test_bad_frame_only_fails_its_session(factory, frame, error):
+    proto = connect(factory)
+    send(proto, session=1, command="open", args="")
+    replies(proto)
+    proto.dataReceived(frame + b"\r\n")
+    assert [msg for _, msg in replies(proto)] == [error]
+    assert not proto.transport.disconnecting
+    send(proto, session=1, command="call", args="1")
+    assert replies(proto)[0] == (1, "Call 1 received\nCall 1 ringing for operator A")
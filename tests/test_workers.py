@@ -0,0 +1,91 @@
+'''Tests for the extra/ server WorkerPool running side work off the reactor.'''
+import json, threading
+from twisted.internet import reactor, defer, task
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+from harness import load
+
+class WorkerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        server = load("extra_server", "extra/server.py")
+        self.pool = server.WorkerPool(size=4, max_pending=4)
+        self.pool.start()
+        self.addCleanup(self.pool.shutdown)
+        self.gate = threading.Event() # Holds blocking jobs until set
+        self.addCleanup(self.gate.set)
+        self.order = []
+
+    def job(self, name, block=False):
+        def work():
+            if block : self.gate.wait(5)
+            self.order.append(name)
+            return name
+        return work
+
+    @defer.inlineCallbacks
+    def test_order_per_call_and_concurrency_across_calls(self):
+        first = self.pool.submit("1", self.job("1a", block=True))
+        second = self.pool.submit("1", self.job("1b"))
+        other = self.pool.submit("2", self.job("2a"))
+        # Call 2 finishes while call 1 is blocked; 1b waits behind 1a
+        self.assertEqual((yield other), "2a")
+        self.assertEqual(self.order, ["2a"])
+        self.gate.set()
+        yield defer.gatherResults([first, second])
+        self.assertEqual(self.order, ["2a", "1a", "1b"])
+        self.assertEqual((self.pool.pending, self.pool.queues), (0, {}))
+
+    @defer.inlineCallbacks
+    def test_submit_refused_when_full(self):
+        jobs = [self.pool.submit(str(i), self.job(i, block=True)) for i in range(4)]
+        self.assertIsNone(self.pool.submit("5", self.job(5)))
+        self.gate.set()
+        yield defer.gatherResults(jobs)
+        self.assertIsNotNone(self.pool.submit("5", self.job(5)))
+
+    @defer.inlineCallbacks
+    def test_hook_errors_are_logged(self):
+        def broken(call_id, event) : raise ValueError(event)
+        def audit(call_id, event)  : self.order.append(event)
+        self.pool.max_pending = 8
+        self.pool.add_hook(broken)
+        self.pool.add_hook(audit)
+        self.pool.dispatch("Call 1 received\nCall 1 ringing for operator A")
+        yield self.pool.submit("1", lambda: None) # Runs after the hooks of call 1
+        self.assertEqual(self.order, ["Call 1 received", "Call 1 ringing for operator A"])
+        self.assertEqual(len(self.flushLoggedErrors(ValueError)), 2)
+
+    @defer.inlineCallbacks
+    def test_stop_cancels_waiting_jobs(self):
+        running = self.pool.submit("1", self.job("1a", block=True))
+        waiting = self.pool.submit("1", self.job("1b"))
+        self.pool.stop()
+        yield self.assertFailure(waiting, defer.CancelledError)
+        self.assertEqual(self.pool.pending, 1)
+        self.assertIsNone(self.pool.submit("2", self.job("2a")))
+        self.gate.set()
+        self.assertEqual((yield running), "1a")
+        self.assertEqual((self.order, self.pool.pending, self.pool.queues), (["1a"], 0, {}))
+
+    def test_shutdown_removes_reactor_trigger(self):
+        trigger = self.pool.trigger
+        self.pool.shutdown()
+        self.assertIsNone(self.pool.trigger)
+        self.assertRaises(ValueError, reactor.removeSystemEventTrigger, trigger)
+
+def test_manager_events_reach_dispatch(monkeypatch):
+    '''Command replies and ring timeouts are both handed to the pool.'''
+    server = load("extra_server", "extra/server.py")
+    monkeypatch.setattr(server, "reactor", task.Clock())
+    factory = server.CallCenterFactory()
+    factory.manager = server.CallManager([server.Operator("A")])
+    factory.manager.protocol = factory
+    dispatched = []
+    monkeypatch.setattr(factory.workers, "dispatch", dispatched.append)
+    proto = factory.buildProtocol(None)
+    proto.makeConnection(StringTransport())
+    proto.dataReceived(json.dumps({"command":"call", "args":"1"}).encode('utf-8') + b"\r\n")
+    server.reactor.advance(10)
+    assert dispatched == ["Call 1 received\nCall 1 ringing for operator A",
+                          "Call 1 ignored by operator A"]